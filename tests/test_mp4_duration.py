@@ -0,0 +1,105 @@
+"""
+Test del parser dei box MP4/MOV usato per leggere la durata dall'header ``mvhd``.
+
+I file vengono costruiti a mano con ``struct``, così i test non dipendono da ffmpeg.
+"""
+
+import os
+import struct
+import tempfile
+import unittest
+
+from video_editor import _mp4_duration
+
+
+def box(box_type, payload):
+    """Box con dimensione a 32 bit."""
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def large_box(box_type, payload):
+    """Box con dimensione a 64 bit (size == 1 seguito da largesize)."""
+    return struct.pack('>I4sQ', 1, box_type, 16 + len(payload)) + payload
+
+
+def open_box(box_type, payload):
+    """Box con size == 0, che si estende fino alla fine del file."""
+    return struct.pack('>I4s', 0, box_type) + payload
+
+
+def mvhd_v0(timescale, duration):
+    return box(b'mvhd', struct.pack('>B3xIIII', 0, 0, 0, timescale, duration) + bytes(80))
+
+
+def mvhd_v1(timescale, duration):
+    return box(b'mvhd', struct.pack('>B3xQQIQ', 1, 0, 0, timescale, duration) + bytes(80))
+
+
+FTYP = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+
+
+class Mp4DurationTest(unittest.TestCase):
+
+    def write(self, data):
+        fd, path = tempfile.mkstemp(suffix='.mp4')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_mvhd_v0_with_moov_after_mdat(self):
+        path = self.write(FTYP + box(b'mdat', bytes(4096)) + box(b'moov', mvhd_v0(1000, 90500)))
+        self.assertEqual(_mp4_duration(path), 90.5)
+
+    def test_mvhd_v0_with_moov_first(self):
+        path = self.write(FTYP + box(b'moov', mvhd_v0(600, 1200)) + box(b'mdat', bytes(16)))
+        self.assertEqual(_mp4_duration(path), 2.0)
+
+    def test_mvhd_v1(self):
+        duration = 2 ** 33
+        path = self.write(FTYP + box(b'moov', mvhd_v1(90000, duration)))
+        self.assertEqual(_mp4_duration(path), duration / 90000)
+
+    def test_largesize_mdat_is_skipped(self):
+        path = self.write(FTYP + large_box(b'mdat', bytes(1024)) + box(b'moov', mvhd_v0(1000, 5000)))
+        self.assertEqual(_mp4_duration(path), 5.0)
+
+    def test_mvhd_after_other_moov_children(self):
+        moov = box(b'moov', box(b'udta', bytes(32)) + mvhd_v0(1000, 7000) + box(b'trak', bytes(64)))
+        path = self.write(FTYP + moov)
+        self.assertEqual(_mp4_duration(path), 7.0)
+
+    def test_open_ended_moov(self):
+        path = self.write(FTYP + open_box(b'moov', mvhd_v0(1000, 3000)))
+        self.assertEqual(_mp4_duration(path), 3.0)
+
+    def test_open_ended_mdat_without_moov(self):
+        path = self.write(FTYP + open_box(b'mdat', bytes(256)))
+        self.assertIsNone(_mp4_duration(path))
+
+    def test_fragmented_mp4(self):
+        moov = box(b'moov', mvhd_v0(1000, 3000) + box(b'mvex', box(b'trex', bytes(24))))
+        path = self.write(FTYP + moov + box(b'moof', bytes(32)) + box(b'mdat', bytes(32)))
+        self.assertIsNone(_mp4_duration(path))
+
+    def test_unknown_or_zero_duration(self):
+        for mvhd in (mvhd_v0(1000, 0), mvhd_v0(1000, 0xFFFFFFFF), mvhd_v1(1000, 2 ** 64 - 1), mvhd_v0(0, 1000)):
+            with self.subTest(mvhd=mvhd[:24]):
+                path = self.write(FTYP + box(b'moov', mvhd))
+                self.assertIsNone(_mp4_duration(path))
+
+    def test_truncated_mvhd(self):
+        path = self.write(FTYP + box(b'moov', mvhd_v1(1000, 5000))[:40])
+        self.assertIsNone(_mp4_duration(path))
+
+    def test_matroska_header(self):
+        path = self.write(bytes.fromhex('1a45dfa3') + bytes.fromhex('9f4286810142f7810142f2810442f38108') + bytes(64))
+        self.assertIsNone(_mp4_duration(path))
+
+    def test_empty_file(self):
+        path = self.write(b'')
+        self.assertIsNone(_mp4_duration(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
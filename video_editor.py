@@ -10,28 +10,92 @@ un sistema di logging per registrare le operazioni e gli errori.
 Funzionalità principali:
 - Montaggio di un nuovo audio su un video esistente
 - Estrazione di intervalli specifici da un video
+- Montaggio audio ed estrazione di intervalli in un solo passaggio
 - Ottenimento della lunghezza totale di un video
 
 Utilizzo:
-    python video_editor.py [-h] (-a VIDEO_INPUT AUDIO_INPUT | -e VIDEO_INPUT INTERVALS | -l VIDEO_INPUT)
+    python video_editor.py [-h] (-a VIDEO_INPUT AUDIO_INPUT | -e VIDEO_INPUT INTERVALS |
+                                 -ae VIDEO_INPUT AUDIO_INPUT INTERVALS | -l VIDEO_INPUT)
 
 Esempi:
     python video_editor.py -a input_video.mp4 new_audio.mp3
     python video_editor.py -e input_video.mp4 "1:30-2:45,3:15-4:00"
+    python video_editor.py -ae input_video.mp4 new_audio.mp3 "1:30-2:45,3:15-4:00"
     python video_editor.py -l input_video.mp4
 
 Note:
-    Tutte le operazioni e gli errori vengono registrati nel file 'log.txt'.
+    Da riga di comando tutte le operazioni e gli errori vengono registrati nel file 'log.txt'.
 """
 
 import argparse
+import bisect
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
 import os
 import logging
-from moviepy.editor import VideoFileClip, concatenate_videoclips
+import re
+import struct
+import subprocess
+import tempfile
+from moviepy.editor import VideoFileClip
 
-# Configurazione del logging
-logging.basicConfig(filename='log.txt', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+try:
+    import av
+except ImportError:  # PyAV è opzionale: senza, le durate vengono lette con ffprobe
+    av = None
+
+# Formato MM:SS o HH:MM:SS
+_TIME_RE = re.compile(r'^(?:(\d+):)?(\d+):(\d+)$')
+
+# Intervallo "inizio-fine" o solo "inizio"; la stringa completa è una lista separata da virgole
+_INTERVAL_PATTERN = r'(\d+(?::\d+){1,2})(?:\s*-\s*(\d+(?::\d+){1,2}))?'
+_INTERVAL_RE = re.compile(_INTERVAL_PATTERN)
+_INTERVALS_RE = re.compile(rf'^\s*{_INTERVAL_PATTERN}(?:\s*,\s*{_INTERVAL_PATTERN})*\s*$')
+
+# Encoder hardware predefinito per ciascun backend di accelerazione di ffmpeg
+GPU_CODECS = {
+    'cuda': 'h264_nvenc',
+    'qsv': 'h264_qsv',
+    'videotoolbox': 'h264_videotoolbox',
+}
+
+# Parametri predefiniti di libx264 quando la ricodifica è necessaria: l'output di un
+# editor di tagli è in genere transitorio, quindi si privilegia la velocità
+DEFAULT_PRESET = 'veryfast'
+DEFAULT_CRF = 23
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+                'medium', 'slow', 'slower', 'veryslow')
+
+@functools.lru_cache(maxsize=None)
+def _nvenc_available():
+    """
+    Verifica se l'ffmpeg installato dispone degli encoder NVENC.
+
+    Il risultato viene memorizzato, quindi ``ffmpeg -encoders`` viene eseguito una sola volta.
+
+    :return: True se è disponibile almeno un encoder NVENC
+    :rtype: bool
+    """
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return 'nvenc' in result.stdout
+
+def _x264_params(preset, crf):
+    """
+    Restituisce i parametri di ffmpeg per codificare il video con libx264.
+
+    :param preset: Preset di libx264
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264
+    :type crf: int
+    :return: Lista di parametri per la riga di comando di ffmpeg
+    :rtype: list of str
+    """
+    return ["-c:v", "libx264", "-preset", preset, "-crf", str(crf)]
 
 def parse_time(time_str):
     """
@@ -46,17 +110,13 @@ def parse_time(time_str):
     :raises ValueError: Se il formato del tempo non è valido
     """
     try:
-        parts = time_str.split(':')
-        if len(parts) == 2:
-            minutes, seconds = map(int, parts)
-        elif len(parts) == 3:
-            hours, minutes, seconds = map(int, parts)
-            minutes += hours * 60
-        else:
+        match = _TIME_RE.match(time_str.strip())
+        if match is None:
             raise ValueError("Formato tempo non valido. Usa MM:SS o HH:MM:SS")
-        return minutes * 60 + seconds
+        hours, minutes, seconds = match.groups()
+        return int(hours or '0', 10) * 3600 + int(minutes, 10) * 60 + int(seconds, 10)
     except ValueError as e:
-        logging.error(f"Errore nel parsing del tempo: {str(e)}")
+        logging.error("Errore nel parsing del tempo: %s", e)
         raise
 
 def parse_intervals(intervals_str):
@@ -71,76 +131,823 @@ def parse_intervals(intervals_str):
     :rtype: list of tuple
     :raises ValueError: Se il formato degli intervalli non è valido
     """
+    if _INTERVALS_RE.match(intervals_str) is None:
+        logging.error("Errore nel parsing degli intervalli: formato non valido: %s", intervals_str)
+        raise ValueError("Formato intervalli non valido. Usa \"1:30-2:45,3:15-4:00\" o \"1:30,3:15\"")
+    # Se non è specificato un intervallo, prendi 60 secondi
+    return [(parse_time(start), parse_time(end) if end else parse_time(start) + 60)
+            for start, end in _INTERVAL_RE.findall(intervals_str)]
+
+def _probe_duration(path):
+    """
+    Legge la durata di un file multimediale dai metadati del container tramite ffprobe.
+
+    :param path: Percorso del file
+    :type path: str
+    :return: Durata in secondi
+    :rtype: float
+    :raises subprocess.CalledProcessError: Se ffprobe termina con errore
+    """
+    output = subprocess.check_output(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                                      "-of", "csv=p=0", path])
+    return float(output)
+
+def _av_duration(path):
+    """
+    Legge la durata di un file multimediale dall'header del container tramite PyAV.
+
+    Se il container non riporta la durata si usa quella del primo stream video.
+
+    :param path: Percorso del file
+    :type path: str
+    :return: Durata in secondi, o None se né il container né lo stream video la riportano
+    :rtype: float
+    """
+    container = av.open(path)
     try:
-        intervals = []
-        for interval in intervals_str.split(','):
-            if '-' in interval:
-                start, end = map(parse_time, interval.split('-'))
-            else:
-                start = parse_time(interval)
-                end = start + 60  # Se non è specificato un intervallo, prendi 60 secondi
-            intervals.append((start, end))
-        return intervals
-    except Exception as e:
-        logging.error(f"Errore nel parsing degli intervalli: {str(e)}")
-        raise
+        if container.duration is not None:
+            return float(container.duration) / av.time_base
+        if not container.streams.video:
+            return None
+        stream = container.streams.video[0]
+        if stream.duration is None or stream.time_base is None:
+            return None
+        return float(stream.duration * stream.time_base)
+    finally:
+        container.close()
+
+def _read_box_header(f):
+    """
+    Legge l'intestazione di un box ISO BMFF (MP4/MOV) alla posizione corrente del file.
+
+    :param f: File aperto in modalità binaria
+    :type f: io.BufferedReader
+    :return: Tupla (tipo, dimensione del contenuto) o None a fine file o se l'intestazione non è valida;
+        la dimensione è None se il box si estende fino alla fine del file
+    :rtype: tuple
+    """
+    header = f.read(8)
+    if len(header) < 8:
+        return None
+    size, box_type = struct.unpack('>I4s', header)
+    if size == 1:
+        large = f.read(8)
+        if len(large) < 8:
+            return None
+        size = struct.unpack('>Q', large)[0] - 16
+    elif size == 0:
+        size = None
+    else:
+        size -= 8
+    if (size is not None and size < 0) or not box_type.isalnum():
+        return None
+    return box_type, size
+
+def _read_mvhd(f):
+    """
+    Legge timescale e durata dal contenuto di un box ``mvhd`` alla posizione corrente del file.
+
+    :param f: File aperto in modalità binaria, posizionato dopo l'intestazione del box
+    :type f: io.BufferedReader
+    :return: Durata in secondi, o None se l'header non riporta la durata
+    :rtype: float
+    """
+    version = f.read(4)[:1]
+    if version == b'\x01':
+        data = f.read(28)
+        layout, unknown = '>16xIQ', 0xFFFFFFFFFFFFFFFF
+    else:
+        data = f.read(16)
+        layout, unknown = '>8xII', 0xFFFFFFFF
+    if len(data) < struct.calcsize(layout):
+        return None
+    timescale, duration = struct.unpack(layout, data)
+    if timescale == 0 or duration in (0, unknown):
+        return None
+    return duration / timescale
+
+def _is_iso_bmff(path):
+    """
+    Indica se un file è un MP4/MOV (ISO BMFF), guardando il tipo del primo box.
+
+    :param path: Percorso del file
+    :type path: str
+    :return: True se il file inizia con un box tipico di MP4/MOV
+    :rtype: bool
+    """
+    with open(path, 'rb') as f:
+        box = _read_box_header(f)
+    return box is not None and box[0] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide')
+
+def _mp4_duration(path):
+    """
+    Legge la durata di un file MP4/MOV direttamente dal box ``mvhd``, senza librerie esterne.
+
+    Scorre i box di primo livello saltando il contenuto (incluso ``mdat``) fino a ``moov``,
+    quindi bastano poche letture anche quando ``moov`` è in fondo al file.
+
+    :param path: Percorso del file
+    :type path: str
+    :return: Durata in secondi, o None se il file non è un MP4 o la durata non è nell'header
+        (ad esempio per gli MP4 frammentati)
+    :rtype: float
+    """
+    with open(path, 'rb') as f:
+        moov_end = None
+        duration = None
+        while moov_end is None or f.tell() < moov_end:
+            box = _read_box_header(f)
+            if box is None:
+                break
+            box_type, size = box
+            box_end = f.tell() + size if size is not None else float('inf')
+            if moov_end is None:
+                if box_type == b'moov':
+                    # Da qui si scorrono i box figli di moov
+                    moov_end = box_end
+                    continue
+            elif box_type == b'mvhd':
+                duration = _read_mvhd(f)
+            elif box_type == b'mvex':
+                # MP4 frammentato: la durata in mvhd non copre i frammenti
+                return None
+            if size is None:
+                break
+            f.seek(box_end)
+    return duration
+
+def _video_duration(path):
+    """
+    Restituisce la durata di un file multimediale senza decodificarlo.
+
+    Per i file MP4/MOV la durata viene letta direttamente dal box ``mvhd``. Negli altri
+    casi usa PyAV se installato, leggendo l'header nello stesso processo, e ffprobe se PyAV
+    manca o non trova la durata.
+
+    :param path: Percorso del file
+    :type path: str
+    :return: Durata in secondi
+    :rtype: float
+    """
+    duration = _mp4_duration(path)
+    if duration is not None:
+        return duration
+    if av is not None:
+        duration = _av_duration(path)
+        if duration is not None:
+            return duration
+    return _probe_duration(path)
+
+def _montaggio_command(video_input, audio_input, output_filename, duration, reencode, hwaccel, gpu_codec,
+                       preset, crf):
+    """
+    Costruisce la riga di comando di ffmpeg per il montaggio audio.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :param audio_input: Percorso del file audio di input
+    :type audio_input: str
+    :param output_filename: Percorso del file video di output
+    :type output_filename: str
+    :param duration: Durata del video in secondi
+    :type duration: float
+    :param reencode: Se True ricodifica il video su CPU invece di copiarlo
+    :type reencode: bool
+    :param hwaccel: Backend di accelerazione hardware o None
+    :type hwaccel: str
+    :param gpu_codec: Encoder video da usare con ``hwaccel``; di default quello del backend
+    :type gpu_codec: str
+    :param preset: Preset di libx264 per la ricodifica su CPU
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264 per la ricodifica su CPU
+    :type crf: int
+    :return: Riga di comando di ffmpeg
+    :rtype: list of str
+    """
+    command = ["ffmpeg", "-y"]
+    if hwaccel is not None:
+        command += ["-hwaccel", hwaccel]
+        if hwaccel == 'cuda':
+            # I frame decodificati restano in memoria GPU fino all'encoder
+            command += ["-hwaccel_output_format", "cuda"]
+    command += ["-i", video_input, "-i", audio_input,
+                "-map", "0:v:0", "-map", "1:a:0"]
+    if hwaccel is not None:
+        codec = gpu_codec or GPU_CODECS[hwaccel]
+        command += ["-c:v", codec]
+        if codec.endswith('_nvenc'):
+            command += ["-preset", "p4"]
+        if hwaccel != 'cuda':
+            command += ["-pix_fmt", "yuv420p"]
+    elif reencode:
+        command += _x264_params(preset, crf) + ["-pix_fmt", "yuv420p"]
+    else:
+        command += ["-c:v", "copy"]
+    # Il video mantiene la sua durata: l'audio più lungo viene troncato
+    return command + ["-c:a", "aac", "-t", str(duration), output_filename]
 
-def montaggio_audio(video_input, audio_input):
+def montaggio_audio(video_input, audio_input, reencode=False, hwaccel=None, gpu_codec=None,
+                    preset=DEFAULT_PRESET, crf=DEFAULT_CRF):
     """
     Sostituisce l'audio di un video con un nuovo file audio.
 
+    Di default la traccia video viene copiata senza ricodifica e viene codificato
+    solo il nuovo audio. Con ``reencode=True`` il video viene ricodificato con libx264
+    in yuv420p. Con ``hwaccel`` il video viene invece ricodificato su GPU:
+    ``"cuda"``, ``"qsv"`` o ``"videotoolbox"`` scelgono il backend, mentre ``"auto"``
+    usa CUDA/NVENC se utilizzabile e altrimenti ripiega sulla CPU. Molte build di ffmpeg
+    elencano NVENC anche senza GPU NVIDIA: con ``"auto"``, se il comando CUDA fallisce,
+    il montaggio viene ripetuto ricodificando su CPU.
+
+    ffmpeg lavora direttamente sui frame nel loro formato nativo, senza passare per
+    la pipe RGB24 di moviepy.
+
     :param video_input: Percorso del file video di input
     :type video_input: str
     :param audio_input: Percorso del file audio di input
     :type audio_input: str
+    :param reencode: Se True ricodifica il video invece di copiarlo
+    :type reencode: bool
+    :param hwaccel: Backend di accelerazione hardware, ``"auto"`` o None
+    :type hwaccel: str
+    :param gpu_codec: Encoder video da usare con ``hwaccel``; di default quello del backend
+    :type gpu_codec: str
+    :param preset: Preset di libx264 per la ricodifica su CPU
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264 per la ricodifica su CPU
+    :type crf: int
     :raises Exception: Se si verifica un errore durante il montaggio audio
     """
     try:
-        video = VideoFileClip(video_input)
-        audio = VideoFileClip(audio_input).audio
-
-        if audio.duration > video.duration:
-            audio = audio.subclip(0, video.duration)
+        auto = hwaccel == 'auto'
+        if auto:
+            hwaccel = 'cuda' if _nvenc_available() else None
+            reencode = True
+        if hwaccel is not None and hwaccel not in GPU_CODECS:
+            raise ValueError(f"Accelerazione hardware non supportata: {hwaccel}")
 
-        final_video = video.set_audio(audio)
+        duration = _video_duration(video_input)
         output_filename = os.path.splitext(os.path.basename(video_input))[0] + '_montato.mp4'
-        final_video.write_videofile(output_filename)
 
-        video.close()
-        audio.close()
-        logging.info(f"Montaggio audio completato: {output_filename}")
+        try:
+            subprocess.run(_montaggio_command(video_input, audio_input, output_filename, duration,
+                                              reencode, hwaccel, gpu_codec, preset, crf),
+                           check=True)
+        except subprocess.CalledProcessError as e:
+            if not auto or hwaccel is None:
+                raise
+            logging.warning("Ricodifica su GPU fallita (codice di uscita %s), ripiego sulla CPU", e.returncode)
+            subprocess.run(_montaggio_command(video_input, audio_input, output_filename, duration,
+                                              True, None, None, preset, crf),
+                           check=True)
+        logging.info("Montaggio audio completato: %s", output_filename)
     except Exception as e:
-        logging.error(f"Errore durante il montaggio audio: {str(e)}")
+        logging.error("Errore durante il montaggio audio: %s", e)
         raise
 
-def estrai_intervalli(video_input, intervals):
+def _probe_start_time(path):
+    """
+    Legge lo ``start_time`` del container tramite ffprobe.
+
+    :param path: Percorso del file
+    :type path: str
+    :return: Tempo assoluto in secondi dell'inizio del file, 0 se non indicato
+    :rtype: float
+    :raises subprocess.CalledProcessError: Se ffprobe termina con errore
+    """
+    output = subprocess.check_output(["ffprobe", "-v", "error", "-show_entries", "format=start_time",
+                                      "-of", "csv=p=0", path],
+                                     text=True).strip()
+    return float(output) if output not in ('', 'N/A') else 0.0
+
+def _keyframes(path, times):
+    """
+    Restituisce i tempi dei keyframe del primo stream video attorno ai tempi indicati.
+
+    Legge solo i pacchetti con ffprobe, senza decodificare i frame, e per ogni tempo
+    solo il tratto tra il keyframe che lo precede e un secondo dopo, grazie a
+    ``-read_intervals``. I tempi restituiti sono relativi all'inizio del file, come
+    quelli accettati da ``-ss``: ffprobe riporta timestamp assoluti, da cui viene
+    sottratto lo ``start_time`` del container.
+
+    :param path: Percorso del file video
+    :type path: str
+    :param times: Tempi in secondi, relativi all'inizio del file, di cui serve il keyframe precedente
+    :type times: list of float
+    :return: Tempi dei keyframe in secondi, in ordine crescente
+    :rtype: list of float
+    :raises subprocess.CalledProcessError: Se ffprobe termina con errore
+    """
+    file_start = _probe_start_time(path)
+    # -read_intervals usa tempi assoluti e fa un seek al keyframe precedente a ciascuno
+    read_intervals = ",".join(f"{time + file_start}%+1" for time in sorted(set(times)))
+    output = subprocess.check_output(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                                      "-read_intervals", read_intervals,
+                                      "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path],
+                                     text=True)
+    keyframes = set()
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.add(float(pts_time) - file_start)
+    # I pacchetti sono in ordine di decodifica, non di presentazione
+    return sorted(keyframes)
+
+def _keyframe_before(keyframes, time):
+    """
+    Trova l'ultimo keyframe che non segue ``time``.
+
+    :param keyframes: Tempi dei keyframe in ordine crescente, come restituiti da ``_keyframes``
+    :type keyframes: list of float
+    :param time: Tempo in secondi
+    :type time: float
+    :return: Tempo del keyframe in secondi, o ``time`` stesso se nessun keyframe lo precede;
+        in quel caso è il seek di ffmpeg a trovare il keyframe
+    :rtype: float
+    """
+    index = bisect.bisect_right(keyframes, time) - 1
+    return keyframes[index] if index >= 0 else time
+
+def _ffmpeg_cut(video_input, start, end, out, reencode=False, seek=None,
+                preset=DEFAULT_PRESET, crf=DEFAULT_CRF):
+    """
+    Taglia un intervallo da un video con ffmpeg.
+
+    ``-ss`` è sempre posto prima di ``-i``, così ffmpeg salta a ``seek`` (di norma il
+    keyframe che precede ``start``) usando l'indice del container invece di decodificare
+    dall'inizio del file. In stream copy il segmento parte da quel keyframe e dura fino
+    a ``end``; con ``reencode=True`` ffmpeg decodifica dal keyframe e scarta i frame
+    fino a ``start``, ottenendo un taglio preciso al frame.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :param start: Inizio dell'intervallo in secondi
+    :type start: int
+    :param end: Fine dell'intervallo in secondi
+    :type end: int
+    :param out: Percorso del segmento di output
+    :type out: str
+    :param reencode: Se True ricodifica il segmento invece di copiarne gli stream
+    :type reencode: bool
+    :param seek: Punto di seek in secondi, non successivo a ``start``; di default ``start``
+    :type seek: float
+    :param preset: Preset di libx264 per la ricodifica
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264 per la ricodifica
+    :type crf: int
+    :raises subprocess.CalledProcessError: Se ffmpeg termina con errore
+    """
+    if seek is None:
+        seek = start
+    # I tagli girano in parallelo: -nostdin evita che ogni ffmpeg legga dal terminale condiviso
+    command = ["ffmpeg", "-nostdin", "-y", "-ss", str(seek), "-i", video_input]
+    if reencode:
+        command += ["-ss", str(start - seek), "-t", str(end - start)] + _x264_params(preset, crf) + ["-c:a", "aac"]
+    else:
+        command += ["-t", str(end - seek), "-c", "copy", "-avoid_negative_ts", "1"]
+    subprocess.run(command + [out], check=True)
+
+def _is_vfr(video_input):
+    """
+    Indica se il primo stream video ha un frame rate variabile.
+
+    Confronta il frame rate medio con quello nominale letti dall'header dello stream.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :return: True se il video sembra a frame rate variabile
+    :rtype: bool
+    """
+    with av.open(video_input) as container:
+        stream = container.streams.video[0]
+        average_rate, base_rate = stream.average_rate, stream.base_rate
+    if not average_rate or not base_rate:
+        return False
+    return abs(float(average_rate) - float(base_rate)) > 0.01 * float(base_rate)
+
+def _remux_streams(container):
+    """
+    Restituisce gli stream da copiare: il primo stream video e, se presente, il primo audio.
+
+    :param container: Container PyAV di input
+    :type container: av.container.InputContainer
+    :return: Lista di stream, con lo stream video per primo
+    :rtype: list
+    """
+    streams = [container.streams.video[0]]
+    if container.streams.audio:
+        streams.append(container.streams.audio[0])
+    return streams
+
+def _add_stream_like(output, stream):
+    """
+    Aggiunge a un container di output uno stream con gli stessi parametri di codifica di ``stream``.
+
+    :param output: Container PyAV di output
+    :type output: av.container.OutputContainer
+    :param stream: Stream di input da replicare
+    :type stream: av.stream.Stream
+    :return: Nuovo stream di output
+    :rtype: av.stream.Stream
+    """
+    # Da PyAV 14 add_stream(template=...) è sostituito da add_stream_from_template
+    if hasattr(output, 'add_stream_from_template'):
+        return output.add_stream_from_template(stream)
+    return output.add_stream(template=stream)
+
+def _remux_interval(container, output, stream_pairs, start, end, offset):
+    """
+    Copia in output i pacchetti di un intervallo senza decodificarli.
+
+    Il seek porta al keyframe video che precede ``start`` e il tratto copiato parte da lì,
+    come per lo stream copy di ffmpeg. I timestamp vengono traslati in modo che il DTS
+    del keyframe cada a ``offset`` secondi nell'output: poiché ogni pacchetto copiato
+    ha PTS precedente a ``end``, i DTS restano crescenti anche tra tratti consecutivi.
+    I pacchetti audio che nel file precedono il keyframe vengono tenuti da parte e copiati
+    se cadono dopo di esso; al primo pacchetto di uno stream oltre ``end`` lo stream
+    viene chiuso, così non restano B-frame privi del frame a cui fanno riferimento.
+    Il remux richiede il DTS di ogni pacchetto: i container che non lo memorizzano
+    (ad esempio Matroska, dove dopo un seek anche il keyframe arriva senza DTS) non sono
+    supportati e fanno sollevare un errore invece di perdere pacchetti.
+
+    ``start`` ed ``end`` sono relativi all'inizio del file, mentre i timestamp dei pacchetti
+    sono assoluti: vengono quindi riportati allo ``start_time`` del container.
+
+    :param container: Container PyAV di input
+    :type container: av.container.InputContainer
+    :param output: Container PyAV di output
+    :type output: av.container.OutputContainer
+    :param stream_pairs: Coppie (stream di input, stream di output), con lo stream video per prima
+    :type stream_pairs: list of tuple
+    :param start: Inizio dell'intervallo in secondi
+    :type start: int
+    :param end: Fine dell'intervallo in secondi
+    :type end: int
+    :param offset: Posizione in secondi dell'inizio del tratto nell'output
+    :type offset: fractions.Fraction
+    :return: Durata in secondi del tratto effettivamente copiato, al più fino a ``end``
+    :rtype: fractions.Fraction
+    :raises ValueError: Se un pacchetto da copiare non ha DTS o se l'intervallo non contiene pacchetti
+    """
+    video_stream = stream_pairs[0][0]
+    output_streams = {stream.index: output_stream for stream, output_stream in stream_pairs}
+    # I tempi restano frazioni esatte per non introdurre errori di arrotondamento tra i tratti
+    file_start = Fraction(container.start_time or 0, av.time_base)
+    start, end = start + file_start, end + file_start
+    container.seek(int(start / video_stream.time_base), stream=video_stream)
+
+    segment_start = None
+    # Pacchetti non video letti prima del keyframe, in attesa di conoscere l'inizio del tratto
+    pending = []
+    muxed = 0
+    # Fine, nel tempo del file, dell'ultimo pacchetto copiato
+    copied_end = None
+    finished = set()
+    for packet in container.demux([stream for stream, _ in stream_pairs]):
+        # I pacchetti di flush a fine stream sono vuoti
+        if packet.size == 0:
+            continue
+        if packet.pts is None or packet.dts is None:
+            raise ValueError("Pacchetto senza timestamp, impossibile copiarlo senza ricodifica")
+        stream = packet.stream
+        if segment_start is None:
+            if stream.index != video_stream.index:
+                # Nel file l'audio può precedere il keyframe pur cadendo dopo di esso
+                pending.append(packet)
+                continue
+            if not packet.is_keyframe:
+                continue
+            segment_start = packet.dts * stream.time_base
+            packets, pending = pending + [packet], []
+        else:
+            packets = [packet]
+
+        for packet in packets:
+            stream = packet.stream
+            # Dopo il primo pacchetto oltre la fine, lo stream è chiuso: i B-frame che seguono
+            # in ordine di decodifica dipendono da quel pacchetto e non sarebbero decodificabili
+            if stream.index in finished or packet.dts * stream.time_base < segment_start:
+                continue
+            if packet.pts * stream.time_base >= end:
+                finished.add(stream.index)
+                continue
+            packet_end = (packet.pts + (packet.duration or 0)) * stream.time_base
+            copied_end = packet_end if copied_end is None else max(copied_end, packet_end)
+            shift = round((offset - segment_start) / stream.time_base)
+            packet.pts += shift
+            packet.dts += shift
+            packet.stream = output_streams[stream.index]
+            output.mux(packet)
+            muxed += 1
+        if len(finished) == len(stream_pairs):
+            break
+
+    if muxed == 0:
+        raise ValueError(f"Nessun pacchetto da copiare nell'intervallo {start - file_start}-{end - file_start}")
+    # Il tratto può finire prima di end, ad esempio se l'intervallo supera la fine del file
+    return min(copied_end, end) - segment_start
+
+def _estrai_intervalli_remux(video_input, intervals, output_filename):
+    """
+    Estrae e concatena gli intervalli copiandone i pacchetti con PyAV, senza decodifica.
+
+    Il file di input viene aperto una sola volta: per ogni intervallo si fa un seek
+    sull'indice del container e i pacchetti vengono scritti di seguito nello stesso
+    output, quindi non servono segmenti temporanei né il concat.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :param intervals: Lista di tuple (inizio, fine) rappresentanti gli intervalli da estrarre
+    :type intervals: list of tuple
+    :param output_filename: Percorso del file video di output
+    :type output_filename: str
+    """
+    with av.open(video_input) as container, av.open(output_filename, 'w') as output:
+        stream_pairs = [(stream, _add_stream_like(output, stream)) for stream in _remux_streams(container)]
+        offset = Fraction(0)
+        for start, end in intervals:
+            offset += _remux_interval(container, output, stream_pairs, start, end, offset)
+
+def _cut_segment(job):
+    """
+    Taglia il segmento i-esimo di un video nella cartella temporanea indicata.
+
+    :param job: Tupla (video_input, i, start, end, tmpdir, reencode, seek, preset, crf)
+    :type job: tuple
+    :return: Percorso del segmento prodotto
+    :rtype: str
+    """
+    video_input, i, start, end, tmpdir, reencode, seek, preset, crf = job
+    segment_path = os.path.join(tmpdir, f'seg_{i:05d}.mp4')
+    _ffmpeg_cut(video_input, start, end, segment_path, reencode, seek, preset, crf)
+    return segment_path
+
+def _concat_segments(segment_paths, output_filename):
+    """
+    Unisce dei segmenti video con il concat demuxer di ffmpeg, senza ricodifica.
+
+    Il concat in stream copy richiede che tutti i segmenti abbiano gli stessi parametri
+    di codifica, come accade per i segmenti tagliati dallo stesso video.
+
+    :param segment_paths: Percorsi dei segmenti, nell'ordine di concatenazione
+    :type segment_paths: list of str
+    :param output_filename: Percorso del file video di output
+    :type output_filename: str
+    :return: True se ffmpeg ha completato il concat, False altrimenti
+    :rtype: bool
+    """
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), 'list.txt')
+    with open(list_path, 'w') as list_file:
+        for segment_path in segment_paths:
+            list_file.write(f"file '{os.path.basename(segment_path)}'\n")
+
+    result = subprocess.run(["ffmpeg", "-nostdin", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                             "-c", "copy", output_filename],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        logging.error("Errore nel concat dei segmenti: %s", result.stderr.strip())
+        return False
+    return True
+
+def _merge_intervals(intervals):
+    """
+    Ordina gli intervalli e unisce quelli che si sovrappongono o si toccano.
+
+    :param intervals: Lista di tuple (inizio, fine) in secondi
+    :type intervals: list of tuple
+    :return: Lista ordinata di tuple (inizio, fine) disgiunte
+    :rtype: list of tuple
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _select_expr(intervals):
+    """
+    Costruisce l'espressione per i filtri select/aselect che tiene solo gli intervalli indicati.
+
+    select scorre il video una sola volta, quindi i frame escono sempre nell'ordine
+    originale e ogni frame al più una volta: gli intervalli vengono ordinati e uniti
+    esplicitamente, segnalandolo nel log se la lista cambia.
+
+    :param intervals: Lista di tuple (inizio, fine) in secondi
+    :type intervals: list of tuple
+    :return: Espressione del tipo ``between(t,s1,e1)+between(t,s2,e2)``
+    :rtype: str
+    """
+    merged = _merge_intervals(intervals)
+    if merged != list(intervals):
+        logging.warning("Con i filtri select gli intervalli vengono ordinati e uniti: %s", merged)
+    return "+".join(f"between(t,{start},{end})" for start, end in merged)
+
+def _estrai_intervalli_filter(video_input, intervals, output_filename, preset, crf):
+    """
+    Estrae e concatena gli intervalli con un'unica invocazione di ffmpeg e i filtri select/aselect.
+
+    Evita di avviare un processo e aprire il file per ogni intervallo, ma richiede
+    la ricodifica perché i filtri non sono compatibili con lo stream copy. Gli intervalli
+    vengono ordinati e quelli sovrapposti uniti.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :param intervals: Lista di tuple (inizio, fine) rappresentanti gli intervalli da estrarre
+    :type intervals: list of tuple
+    :param output_filename: Percorso del file video di output
+    :type output_filename: str
+    :param preset: Preset di libx264
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264
+    :type crf: int
+    :raises subprocess.CalledProcessError: Se ffmpeg termina con errore
+    """
+    select_expr = _select_expr(intervals)
+    subprocess.run(["ffmpeg", "-y", "-i", video_input,
+                    "-vf", f"select='{select_expr}',setpts=N/FRAME_RATE/TB",
+                    "-af", f"aselect='{select_expr}',asetpts=N/SR/TB"]
+                   + _x264_params(preset, crf) + ["-c:a", "aac", output_filename],
+                   check=True)
+
+def _write_moviepy_segments(video, intervals, tmpdir, preset, crf):
+    """
+    Scrive su disco un segmento ricodificato per ogni intervallo, uno alla volta.
+
+    :param video: Clip di partenza
+    :type video: VideoFileClip
+    :param intervals: Lista di tuple (inizio, fine) rappresentanti gli intervalli da estrarre
+    :type intervals: list of tuple
+    :param tmpdir: Cartella in cui scrivere i segmenti
+    :type tmpdir: str
+    :param preset: Preset di libx264
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264
+    :type crf: int
+    :return: Generatore dei percorsi dei segmenti, nell'ordine degli intervalli
+    :rtype: generator
+    """
+    for i, (start, end) in enumerate(intervals):
+        segment_path = os.path.join(tmpdir, f'seg_{i:05d}.mp4')
+        # I subclip condividono il reader di `video`: il file viene aperto una sola volta
+        clip = video.subclip(start, end)
+        # threads=0 lascia scegliere a ffmpeg il numero di thread dell'encoder
+        clip.write_videofile(segment_path, codec='libx264', preset=preset, ffmpeg_params=["-crf", str(crf)],
+                             audio_codec='aac', threads=0)
+        # Chiudere il subclip chiuderebbe il reader condiviso: basta rilasciarlo
+        del clip
+        yield segment_path
+
+def _estrai_intervalli_moviepy(video_input, intervals, output_filename, preset, crf):
+    """
+    Estrae e concatena gli intervalli tramite moviepy, ricodificando il video.
+
+    Più lento dello stream copy, ma i tagli sono precisi al frame anche
+    quando non cadono su un keyframe. Ogni intervallo viene scritto su un segmento
+    temporaneo, così in memoria c'è un solo subclip alla volta; i segmenti, codificati
+    tutti con gli stessi parametri, vengono poi uniti con il concat demuxer.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :param intervals: Lista di tuple (inizio, fine) rappresentanti gli intervalli da estrarre
+    :type intervals: list of tuple
+    :param output_filename: Percorso del file video di output
+    :type output_filename: str
+    :param preset: Preset di libx264
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264
+    :type crf: int
+    :raises RuntimeError: Se il concat dei segmenti fallisce
+    """
+    video = VideoFileClip(video_input)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            segment_paths = list(_write_moviepy_segments(video, intervals, tmpdir, preset, crf))
+            if not _concat_segments(segment_paths, output_filename):
+                raise RuntimeError("Concat dei segmenti ricodificati con moviepy fallito")
+    finally:
+        video.close()
+
+def estrai_intervalli(video_input, intervals, reencode=False, mode='copy',
+                      preset=DEFAULT_PRESET, crf=DEFAULT_CRF):
     """
     Estrae intervalli specifici da un video e li concatena in un nuovo video.
 
+    Con ``mode="copy"`` (default) ogni intervallo viene tagliato con ffmpeg in stream copy
+    e i segmenti vengono uniti con il concat demuxer, senza decodificare né ricodificare
+    i frame. I tagli vengono eseguiti in parallelo, uno per core. Se PyAV è installato
+    e l'input è un MP4/MOV gli intervalli vengono invece copiati pacchetto per pacchetto
+    in un unico output, aprendo il file una sola volta e senza avviare ffmpeg; per i
+    video a frame rate variabile si passa alla ricodifica, e se il remux fallisce si
+    ripiega sui tagli con ffmpeg. Se il concat in stream copy fallisce
+    (ad esempio per parametri di codifica diversi) si ripiega su moviepy.
+    I tagli in stream copy partono dal keyframe più vicino: se servono tagli precisi
+    al frame usare ``reencode=True``, che ricodifica ogni segmento con libx264.
+
+    Con ``mode="filter"`` tutti gli intervalli vengono estratti in un solo passaggio
+    di ffmpeg con i filtri select/aselect, ricodificando sempre il video. In questa
+    modalità l'output segue l'ordine del video di partenza: gli intervalli vengono
+    ordinati e quelli sovrapposti uniti, mentre ``mode="copy"`` mantiene l'ordine
+    indicato e ripete i tratti sovrapposti.
+
+    Ogni ricodifica usa libx264 con ``preset`` e ``crf``.
+
     :param video_input: Percorso del file video di input
     :type video_input: str
     :param intervals: Lista di tuple (inizio, fine) rappresentanti gli intervalli da estrarre
     :type intervals: list of tuple
+    :param reencode: Se True ricodifica i segmenti per tagli precisi al frame
+    :type reencode: bool
+    :param mode: ``"copy"`` per tagliare e unire i segmenti, ``"filter"`` per un unico passaggio con select
+    :type mode: str
+    :param preset: Preset di libx264 per la ricodifica
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264 per la ricodifica
+    :type crf: int
     :raises Exception: Se si verifica un errore durante l'estrazione degli intervalli
     """
     try:
-        video = VideoFileClip(video_input)
-        clips = []
-        for start, end in intervals:
-            clip = video.subclip(start, end)
-            clips.append(clip)
-        
-        final_video = concatenate_videoclips(clips)
+        if mode not in ('copy', 'filter'):
+            raise ValueError(f"Modalità di estrazione non valida: {mode}")
 
         output_filename = os.path.splitext(os.path.basename(video_input))[0] + '_estratto.mp4'
-        final_video.write_videofile(output_filename)
 
-        video.close()
-        for clip in clips:
-            clip.close()
-        logging.info(f"Estrazione intervalli completata: {output_filename}")
+        if mode == 'filter':
+            _estrai_intervalli_filter(video_input, intervals, output_filename, preset, crf)
+        else:
+            # Solo MP4/MOV garantiscono il DTS di ogni pacchetto, necessario al remux
+            remux = av is not None and not reencode and _is_iso_bmff(video_input)
+            if remux:
+                try:
+                    if _is_vfr(video_input):
+                        # Con frame rate variabile i tagli senza decodifica non sono affidabili
+                        logging.info("Video a frame rate variabile, uso la ricodifica: %s", video_input)
+                        remux, reencode = False, True
+                    else:
+                        _estrai_intervalli_remux(video_input, intervals, output_filename)
+                except Exception as e:
+                    logging.warning("Remux con PyAV fallito (%s), uso ffmpeg", e)
+                    if os.path.exists(output_filename):
+                        os.remove(output_filename)
+                    remux = False
+
+            if not remux:
+                # L'indice dei keyframe viene letto una volta e condiviso da tutti gli intervalli
+                keyframes = _keyframes(video_input, [start for start, _ in intervals])
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    # Ogni taglio è un processo ffmpeg indipendente: i thread bastano a parallelizzarli
+                    jobs = [(video_input, i, start, end, tmpdir, reencode,
+                             _keyframe_before(keyframes, start), preset, crf)
+                            for i, (start, end) in enumerate(intervals)]
+                    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                        segment_paths = list(executor.map(_cut_segment, jobs))
+
+                    if not _concat_segments(segment_paths, output_filename):
+                        logging.warning("Concat in stream copy fallito, uso moviepy con ricodifica")
+                        _estrai_intervalli_moviepy(video_input, intervals, output_filename, preset, crf)
+
+        logging.info("Estrazione intervalli completata: %s", output_filename)
     except Exception as e:
-        logging.error(f"Errore durante l'estrazione degli intervalli: {str(e)}")
+        logging.error("Errore durante l'estrazione degli intervalli: %s", e)
+        raise
+
+def montaggio_estrai_intervalli(video_input, audio_input, intervals, preset=DEFAULT_PRESET, crf=DEFAULT_CRF):
+    """
+    Sostituisce l'audio di un video ed estrae intervalli specifici in un unico passaggio.
+
+    Equivale a ``montaggio_audio`` seguito da ``estrai_intervalli`` sul video montato:
+    il nuovo audio segue la linea temporale del video e gli intervalli vengono tagliati
+    da entrambi. Un solo grafo di filtri di ffmpeg applica select al video e aselect
+    al nuovo audio, così il video viene decodificato e ricodificato una sola volta.
+    Come per ``estrai_intervalli(..., mode="filter")`` gli intervalli vengono ordinati
+    e quelli sovrapposti uniti.
+
+    :param video_input: Percorso del file video di input
+    :type video_input: str
+    :param audio_input: Percorso del file audio di input
+    :type audio_input: str
+    :param intervals: Lista di tuple (inizio, fine) rappresentanti gli intervalli da estrarre
+    :type intervals: list of tuple
+    :param preset: Preset di libx264
+    :type preset: str
+    :param crf: Constant Rate Factor di libx264
+    :type crf: int
+    :raises Exception: Se si verifica un errore durante l'elaborazione
+    """
+    try:
+        select_expr = _select_expr(intervals)
+        filter_graph = (f"[0:v]select='{select_expr}',setpts=N/FRAME_RATE/TB[vout];"
+                        f"[1:a]aselect='{select_expr}',asetpts=N/SR/TB[aout]")
+        output_filename = os.path.splitext(os.path.basename(video_input))[0] + '_montato_estratto.mp4'
+
+        subprocess.run(["ffmpeg", "-y", "-i", video_input, "-i", audio_input,
+                        "-filter_complex", filter_graph, "-map", "[vout]", "-map", "[aout]"]
+                       + _x264_params(preset, crf) + ["-c:a", "aac", output_filename],
+                       check=True)
+        logging.info("Montaggio audio ed estrazione intervalli completati: %s", output_filename)
+    except Exception as e:
+        logging.error("Errore durante il montaggio audio con estrazione degli intervalli: %s", e)
         raise
 
 def get_video_length(video_input):
@@ -154,15 +961,13 @@ def get_video_length(video_input):
     :raises Exception: Se si verifica un errore nell'ottenere la lunghezza del video
     """
     try:
-        video = VideoFileClip(video_input)
-        duration = video.duration
+        duration = _video_duration(video_input)
         minutes = int(duration // 60)
         seconds = int(duration % 60)
-        video.close()
-        logging.info(f"Lunghezza video ottenuta: {minutes} minuti e {seconds} secondi")
+        logging.info("Lunghezza video ottenuta: %s minuti e %s secondi", minutes, seconds)
         return minutes, seconds
     except Exception as e:
-        logging.error(f"Errore nell'ottenere la lunghezza del video: {str(e)}")
+        logging.error("Errore nell'ottenere la lunghezza del video: %s", e)
         raise
 
 def main():
@@ -180,26 +985,55 @@ def main():
     group.add_argument('-e', '--extract', nargs=2, metavar=('VIDEO_INPUT', 'INTERVALS'),
                        help='Estrai intervalli da un video. Richiede il path del video e gli intervalli '
                             'nel formato "1:35-3:00,4:20-12:24,..." o "1:35,3:00,4:20,..."')
+    group.add_argument('-ae', '--audio-extract', nargs=3, metavar=('VIDEO_INPUT', 'AUDIO_INPUT', 'INTERVALS'),
+                       help='Monta un audio su un video ed estrai degli intervalli in un solo passaggio. '
+                            'Richiede il path del video, il path dell\'audio e gli intervalli nel formato di -e, '
+                            'che vengono ordinati e uniti se sovrapposti.')
     group.add_argument('-l', '--length', metavar='VIDEO_INPUT',
                        help='Ottieni la lunghezza del video. Richiede il path del video.')
+    parser.add_argument('--mode', choices=('copy', 'filter'), default='copy',
+                        help='Modalità di estrazione per -e: "copy" taglia e unisce i segmenti senza '
+                             'ricodifica, "filter" estrae tutto in un solo passaggio ricodificando. '
+                             'Con "filter" gli intervalli vengono ordinati e quelli sovrapposti uniti.')
+    parser.add_argument('--reencode', action='store_true',
+                        help='Ricodifica il video con -a, o taglia gli intervalli con precisione al frame con -e.')
+    parser.add_argument('--hwaccel', choices=('auto',) + tuple(GPU_CODECS),
+                        help='Ricodifica il video su GPU con -a: "auto" usa CUDA/NVENC se utilizzabile '
+                             'e altrimenti la CPU. Di default il video viene copiato senza ricodifica.')
+    parser.add_argument('--preset', choices=X264_PRESETS, default=DEFAULT_PRESET,
+                        help='Preset di libx264 usato quando il video viene ricodificato (default: %(default)s).')
+    parser.add_argument('--crf', type=int, default=DEFAULT_CRF,
+                        help='Constant Rate Factor di libx264 usato quando il video viene ricodificato '
+                             '(default: %(default)s).')
 
     args = parser.parse_args()
 
+    # Configurazione del logging: solo da riga di comando, l'import del modulo non apre log.txt
+    logging.basicConfig(filename='log.txt', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
     try:
         if args.audio:
-            logging.info(f"Avvio montaggio audio: {args.audio[0]}, {args.audio[1]}")
-            montaggio_audio(args.audio[0], args.audio[1])
+            logging.info("Avvio montaggio audio: %s, %s", args.audio[0], args.audio[1])
+            montaggio_audio(args.audio[0], args.audio[1], reencode=args.reencode, hwaccel=args.hwaccel,
+                            preset=args.preset, crf=args.crf)
         elif args.extract:
-            logging.info(f"Avvio estrazione intervalli: {args.extract[0]}, {args.extract[1]}")
+            logging.info("Avvio estrazione intervalli: %s, %s", args.extract[0], args.extract[1])
             intervals = parse_intervals(args.extract[1])
-            estrai_intervalli(args.extract[0], intervals)
+            estrai_intervalli(args.extract[0], intervals, reencode=args.reencode, mode=args.mode,
+                              preset=args.preset, crf=args.crf)
+        elif args.audio_extract:
+            logging.info("Avvio montaggio audio con estrazione intervalli: %s, %s, %s", *args.audio_extract)
+            intervals = parse_intervals(args.audio_extract[2])
+            montaggio_estrai_intervalli(args.audio_extract[0], args.audio_extract[1], intervals,
+                                        preset=args.preset, crf=args.crf)
         elif args.length:
-            logging.info(f"Richiesta lunghezza video: {args.length}")
+            logging.info("Richiesta lunghezza video: %s", args.length)
             minutes, seconds = get_video_length(args.length)
             print(f"La lunghezza del video è {minutes} minuti e {seconds} secondi.")
         logging.info("Operazione completata con successo")
     except Exception as e:
-        logging.error(f"Si è verificato un errore durante l'esecuzione: {str(e)}")
+        logging.error("Si è verificato un errore durante l'esecuzione: %s", e)
         print(f"Si è verificato un errore. Controlla il file log.txt per i dettagli.")
 
 if __name__ == "__main__":